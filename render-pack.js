@@ -0,0 +1,98 @@
+// Pakiet oferty — wiele kompozycji w jednej sesji Remotion.
+// Jeden bundle i jedna przeglądarka: zdjęcia, fonty i logo pobierane są raz
+// i trafiają do cache przeglądarki współdzielonego przez wszystkie rendery.
+//
+// Użycie: node render-pack.js <manifest.json>
+// Manifest: { "jobs": [{ "mode": "render" | "still", "composition", "output",
+//             "props", "width"?, "height"?, "imageFormat"?, "jpegQuality"? }] }
+
+const fs = require("fs");
+const path = require("path");
+const { bundle } = require("@remotion/bundler");
+const {
+  ensureBrowser,
+  openBrowser,
+  selectComposition,
+  renderMedia,
+  renderStill,
+} = require("@remotion/renderer");
+
+const main = async () => {
+  const manifest = JSON.parse(fs.readFileSync(process.argv[2], "utf-8"));
+  const jobs = manifest.jobs || [];
+
+  console.log("Bundling...");
+  const serveUrl = await bundle({
+    entryPoint: path.join(__dirname, "src", "index.ts"),
+    publicDir: path.join(__dirname, "public"),
+  });
+
+  // Ta sama przeglądarka co `npx remotion` (run_remotion): headless shell Remotion,
+  // nie systemowy chromium — obie ścieżki renderują identycznie
+  await ensureBrowser();
+  const browser = await openBrowser("chrome", {
+    chromiumOptions: { gl: "angle" },
+  });
+
+  let lastLine = "";
+  try {
+    for (const [i, job] of jobs.entries()) {
+      const composition = await selectComposition({
+        serveUrl,
+        id: job.composition,
+        inputProps: job.props,
+        puppeteerInstance: browser,
+      });
+
+      if (job.mode === "still") {
+        await renderStill({
+          composition: {
+            ...composition,
+            width: job.width || composition.width,
+            height: job.height || composition.height,
+          },
+          serveUrl,
+          output: job.output,
+          inputProps: job.props,
+          frame: 0,
+          imageFormat: job.imageFormat || "png",
+          jpegQuality: job.imageFormat === "jpeg" ? job.jpegQuality : undefined,
+          puppeteerInstance: browser,
+        });
+      } else {
+        // Optymalizacja dla slabych serwerow (Render free tier)
+        await renderMedia({
+          composition,
+          serveUrl,
+          codec: "h264",
+          outputLocation: job.output,
+          inputProps: job.props,
+          concurrency: 1,
+          chromiumOptions: { gl: "angle" },
+          puppeteerInstance: browser,
+          onProgress: ({ renderedFrames, encodedFrames }) => {
+            // Ten sam format co CLI — server.py parsuje go na zdarzenia postępu
+            const total = composition.durationInFrames;
+            const line = encodedFrames > 0
+              ? `Encoding video ${encodedFrames}/${total}`
+              : `Rendering frames ${renderedFrames}/${total}`;
+            if (line !== lastLine) {
+              console.log(line);
+              lastLine = line;
+            }
+          },
+        });
+      }
+
+      // Pełna ścieżka — server.py po niej startuje kodowanie gotowego slajdu
+      console.log(`Done ${i + 1}/${jobs.length}: ${job.output}`);
+    }
+  } finally {
+    await browser.close({ silent: true });
+  }
+};
+
+main().catch((err) => {
+  console.error(err);
+  process.exit(1);
+});
@@ -4,12 +4,17 @@
 import os
 import json
 import uuid
+import signal
 import subprocess
 import shutil
+import threading
+import time
 import zipfile
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, Response, request, jsonify, make_response, send_file, render_template
 
 try:
     import requests as req
@@ -24,6 +29,12 @@ try:
 except ImportError:
     HAS_CURL_CFFI = False
 
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
 app = Flask(__name__)
 
 BASE_DIR = Path(__file__).parent
@@ -34,6 +45,45 @@ OUT_DIR = BASE_DIR / "out"
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Formaty i rozmiary slajdów karuzeli (format -> rozszerzenie, nazwa -> szer. x wys.)
+CAROUSEL_FORMATS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+CAROUSEL_SIZES = {"1080x1080": (1080, 1080), "1080x1350": (1080, 1350)}
+
+# Szablony renderowane razem w pakiecie oferty (/render z template "pack")
+PACK_TEMPLATES = ("reel", "carousel", "sold")
+PACK_DONE_RE = re.compile(r"^Done \d+/\d+: (.+)$")  # linia z render-pack.js po każdej kompozycji
+
+# Kodowanie slajdów w tle, podczas gdy Remotion renderuje kolejne
+ENCODE_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("ENCODE_WORKERS", 2)))
+
+# Równoległe procesy Remotion (sloty zwalniane od razu po anulowaniu)
+RENDER_SLOTS = threading.BoundedSemaphore(int(os.environ.get("RENDER_WORKERS", 2)))
+
+# Stan renderów dla /render/<id>/progress i /render/<id>/cancel
+RENDER_JOBS = {}
+RENDER_JOBS_LOCK = threading.Condition()
+RENDER_JOB_TTL = 300  # s po zakończeniu, potem stan jest usuwany
+RENDER_JOB_MAX_AGE = 7200  # s — bezpiecznik dla stanu, który nigdy się nie zakończył
+RENDER_STREAM_GRACE = 10  # s — ile strumień czeka, aż POST /render utworzy render
+RENDER_KILL_GRACE = 5  # s między SIGTERM a SIGKILL przy anulowaniu
+# Bez "-": pliki renderu to "{render_id}-*", więc id nie może być prefiksem innego
+RENDER_ID_RE = re.compile(r"[A-Za-z0-9_]{1,32}")
+
+# Parsowanie wyjścia Remotion ("Rendering frames 45/240", "Encoding video 120/240", "Bundling 80%")
+PROGRESS_STAGES = (
+    ("bundling", re.compile(r"bundl", re.I)),
+    ("encoding", re.compile(r"encod|stitch", re.I)),
+    ("rendering", re.compile(r"render", re.I)),
+)
+PROGRESS_KEYWORD_RE = re.compile(r"bundl|encod|stitch|render", re.I)
+PROGRESS_FRAMES_RE = re.compile(r"(\d+)\s*/\s*(\d+)")
+PROGRESS_PERCENT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+PROGRESS_ETA_RE = re.compile(r"(?:time remaining|remaining|eta)\W*((?:\d+\s*[hms]\s*)+)", re.I)
+
+
+class RenderCancelled(Exception):
+    """Render anulowany przez klienta"""
+
 
 @app.route("/")
 def index():
@@ -100,35 +150,210 @@ def upload_logo():
 def render_video():
     """Renderuj wideo lub karuzelę"""
     data = request.json
-    template = data.get("template", "reel")  # reel / carousel / sold
-    render_id = str(uuid.uuid4())[:8]
+    template = data.get("template", "reel")  # reel / carousel / sold / plot / pack
+    # Klient może podać własne render_id, żeby od razu subskrybować postęp
+    render_id = str(data.get("render_id") or str(uuid.uuid4())[:8])
+    if not RENDER_ID_RE.fullmatch(render_id):
+        return jsonify({"error": "Nieprawidłowe render_id"}), 400
+
+    with RENDER_JOBS_LOCK:
+        prune_render_jobs()
+        # Id jest jednorazowe: ponowne użycie nadpisałoby (albo przy błędzie usunęło)
+        # pliki wcześniejszego renderu z tym samym id
+        if render_id in RENDER_JOBS or any(OUT_DIR.glob(f"{render_id}-*")):
+            return jsonify({"error": f"render_id {render_id} był już użyty"}), 409
+        create_render_job(render_id)
 
     try:
         if template == "reel":
-            return render_reel(data, render_id)
+            result = render_reel(data, render_id)
         elif template == "carousel":
-            return render_carousel(data, render_id)
+            result = render_carousel(data, render_id)
         elif template == "sold":
-            return render_sold(data, render_id)
+            result = render_sold(data, render_id)
         elif template == "plot":
-            return render_plot(data, render_id)
+            result = render_plot(data, render_id)
+        elif template == "pack":
+            result = render_pack(data, render_id)
         else:
-            return jsonify({"error": f"Nieznany szablon: {template}"}), 400
+            result = jsonify({"error": f"Nieznany szablon: {template}"}), 400
+    except RenderCancelled:
+        result = jsonify({"error": "Renderowanie anulowane", "cancelled": True}), 409
     except subprocess.CalledProcessError as e:
-        return jsonify({
+        result = jsonify({
             "error": "Rendering nie powiódł się",
             "details": e.stderr.decode("utf-8", errors="replace") if e.stderr else str(e)
         }), 500
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        result = jsonify({"error": str(e)}), 500
+
+    response = make_response(result)
+    if response.status_code >= 409:
+        # Anulowany / nieudany render nie zostawia częściowych plików w OUT_DIR
+        discard_render_outputs(render_id)
+    return finish_render_job(render_id, response)
+
+
+@app.route("/render/<render_id>/progress")
+def render_progress(render_id):
+    """Strumień postępu renderu (Server-Sent Events)"""
+    if not RENDER_ID_RE.fullmatch(render_id):
+        return jsonify({"error": "Nieprawidłowe render_id"}), 400
+
+    prune_render_jobs()
+
+    # EventSource po zerwaniu połączenia wznawia od ostatniego id
+    last_id = request.headers.get("Last-Event-ID", "0")
+    last_id = int(last_id) if last_id.isdigit() else 0
+
+    def stream():
+        # Subskrypcja może przyjść chwilę przed POST /render — czekamy, ale stanu nie tworzymy
+        deadline = time.monotonic() + RENDER_STREAM_GRACE
+        with RENDER_JOBS_LOCK:
+            while render_id not in RENDER_JOBS and time.monotonic() < deadline:
+                RENDER_JOBS_LOCK.wait(timeout=max(deadline - time.monotonic(), 0))
+            job = RENDER_JOBS.get(render_id)
+
+        if job is None:
+            # "failed", nie "error" — "error" to wbudowane zdarzenie EventSource (zerwane połączenie)
+            event = {"type": "failed", "error": "Nieznany lub wygasły render", "render_id": render_id}
+            yield f"event: failed\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            return
+
+        sent = last_id
+        while True:
+            with RENDER_JOBS_LOCK:
+                if job["seq"] <= sent and not job["finished"]:
+                    RENDER_JOBS_LOCK.wait(timeout=15)
+                events = [e for e in job["events"] if e["id"] > sent]
+                finished = job["finished"]
+
+            if not events:
+                if finished:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                sent = event["id"]
+                yield f"id: {sent}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@app.route("/render/<render_id>/cancel", methods=["POST"])
+def cancel_render(render_id):
+    """Anuluj render — zabija drzewo procesów Remotion i zwalnia slot"""
+    with RENDER_JOBS_LOCK:
+        job = RENDER_JOBS.get(render_id)
+        if job is None or job["finished"]:
+            return jsonify({"error": "Render nie jest aktywny"}), 404
+        job["cancelled"] = True
+        proc = job["proc"]
+
+    if proc is not None:
+        kill_process_tree(proc)
+    push_render_event(render_id, {"type": "cancelling"})
+
+    return jsonify({"success": True})
+
+
+def create_render_job(render_id):
+    """Utwórz stan renderu (tylko POST /render) i obudź czekające strumienie"""
+    with RENDER_JOBS_LOCK:
+        job = {
+            "events": [],
+            "seq": 0,
+            "proc": None,
+            "step": 0,
+            "cancelled": False,
+            "finished": False,
+            "created": time.monotonic(),
+            "finished_at": None,
+        }
+        RENDER_JOBS[render_id] = job
+        RENDER_JOBS_LOCK.notify_all()
+        return job
+
+
+def prune_render_jobs():
+    """Usuń zakończone rendery po RENDER_JOB_TTL i porzucone po RENDER_JOB_MAX_AGE"""
+    now = time.monotonic()
+    with RENDER_JOBS_LOCK:
+        for render_id, job in list(RENDER_JOBS.items()):
+            if job["finished"]:
+                expired = now - job["finished_at"] > RENDER_JOB_TTL
+            else:
+                expired = now - job["created"] > RENDER_JOB_MAX_AGE
+            if expired:
+                RENDER_JOBS.pop(render_id)
+
+
+def discard_render_outputs(render_id):
+    """Usuń wszystkie pliki renderu z OUT_DIR (props, manifest, częściowe wyniki)"""
+    for f in OUT_DIR.glob(f"{render_id}-*"):
+        f.unlink(missing_ok=True)
+
+
+def push_render_event(render_id, event):
+    """Dodaj zdarzenie do strumienia postępu i obudź subskrybentów"""
+    with RENDER_JOBS_LOCK:
+        job = RENDER_JOBS.get(render_id)
+        if job is None:
+            return
+        job["seq"] += 1
+        event = {**event, "id": job["seq"], "render_id": render_id}
+        # Kolejne zdarzenia postępu zastępują poprzednie — lista nie rośnie z każdą klatką
+        if event["type"] == "progress" and job["events"] and job["events"][-1]["type"] == "progress":
+            job["events"].pop()
+        job["events"].append(event)
+        RENDER_JOBS_LOCK.notify_all()
+
+
+def finish_render_job(render_id, response):
+    """Zamknij strumień postępu wynikiem renderu"""
+    payload = response.get_json(silent=True) or {}
+    if response.status_code == 200:
+        event = {"type": "done", "result": payload}
+    elif payload.get("cancelled"):
+        event = {"type": "cancelled"}
+    else:
+        event = {"type": "failed", "error": payload.get("error", "Nieznany błąd")}
+    push_render_event(render_id, event)
+
+    with RENDER_JOBS_LOCK:
+        job = RENDER_JOBS.get(render_id)
+        if job is not None:
+            job["finished"] = True
+            job["finished_at"] = time.monotonic()
+        RENDER_JOBS_LOCK.notify_all()
+    return response
 
 
 def render_reel(data, render_id):
     """Renderuj rolkę ofertową (RealEstateReel)"""
-    photos = data.get("photos", [])
-    if not photos:
+    if not data.get("photos"):
         return jsonify({"error": "Dodaj przynajmniej 1 zdjęcie"}), 400
 
+    props = build_reel_props(data)
+    props_file = OUT_DIR / f"{render_id}-props.json"
+    props_file.write_text(json.dumps(props, ensure_ascii=False))
+
+    output_file = OUT_DIR / f"{render_id}-rolka.mp4"
+    try:
+        run_remotion("render", "RealEstateReel", str(output_file), str(props_file), render_id=render_id)
+    finally:
+        props_file.unlink(missing_ok=True)
+
+    return jsonify(video_result(render_id, "rolka"))
+
+
+def build_reel_props(data):
+    """Props dla RealEstateReel"""
+    photos = list(data.get("photos", []))
+
     # Uzupełnij do 5 zdjęć (powtórz ostatnie)
     while len(photos) < 5:
         photos.append(photos[-1].copy())
@@ -164,29 +389,63 @@ def render_reel(data, render_id):
     if effects:
         props["effects"] = effects
 
-    props_file = OUT_DIR / f"{render_id}-props.json"
-    props_file.write_text(json.dumps(props, ensure_ascii=False))
-
-    output_file = OUT_DIR / f"{render_id}-rolka.mp4"
-    run_remotion("render", "RealEstateReel", str(output_file), str(props_file))
+    return props
 
-    # Cleanup props
-    props_file.unlink(missing_ok=True)
 
-    return jsonify({
+def video_result(render_id, name):
+    """Odpowiedź dla wyrenderowanego wideo MP4"""
+    return {
         "success": True,
         "type": "video",
-        "download_url": f"/download/{render_id}-rolka.mp4",
-        "filename": f"rolka-{render_id}.mp4",
-    })
+        "download_url": f"/download/{render_id}-{name}.mp4",
+        "filename": f"{name}-{render_id}.mp4",
+    }
 
 
 def render_carousel(data, render_id):
-    """Renderuj karuzelę Instagram (5 slajdów PNG)"""
-    photos = data.get("photos", [])
-    if not photos:
+    """Renderuj karuzelę Instagram (slajdy PNG / JPEG / WebP, opcjonalnie w kilku rozmiarach)"""
+    if not data.get("photos"):
         return jsonify({"error": "Dodaj przynajmniej 1 zdjęcie"}), 400
 
+    try:
+        output = get_carousel_output(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    slides = build_carousel_slides(data)
+    items = plan_carousel_slides(render_id, slides, output)
+
+    # Render each slide; encoding runs in ENCODE_POOL meanwhile
+    try:
+        for i, item in enumerate(items):
+            props_file = OUT_DIR / f"{render_id}-slide-{i}-props.json"
+            props_file.write_text(json.dumps(item["props"], ensure_ascii=False))
+
+            size_args = []
+            if (item["width"], item["height"]) != (1080, 1080):
+                size_args = ["--width", str(item["width"]), "--height", str(item["height"])]
+
+            try:
+                if output["encode"]:
+                    # Remotion renderuje bezstratny PNG, Pillow koduje go w tle
+                    run_remotion("still", "CarouselSlide", str(item["render_file"]), str(props_file), size_args,
+                                 render_id=render_id)
+                    item["job"] = ENCODE_POOL.submit(encode_slide, item["render_file"], item["output_file"], output)
+                else:
+                    run_remotion("still", "CarouselSlide", str(item["render_file"]), str(props_file),
+                                 size_args + output["remotion_args"], render_id=render_id)
+            finally:
+                props_file.unlink(missing_ok=True)
+
+        return jsonify(zip_carousel(render_id, items, output, len(slides)))
+    except BaseException:
+        discard_carousel(render_id, items)
+        raise
+
+
+def build_carousel_slides(data):
+    """Lista slajdów karuzeli: [(nazwa, props), ...]"""
+    photos = data.get("photos", [])
     slides = []
     total_slides = 2 + min(len(photos), 3) + 1  # cover + photos + details + cta
 
@@ -259,43 +518,164 @@ def render_carousel(data, render_id):
     }
     slides.append(("cta", cta_props))
 
-    # Render each slide as PNG
-    output_files = []
-    for i, (name, props) in enumerate(slides):
-        props_file = OUT_DIR / f"{render_id}-slide-{i}-props.json"
-        props_file.write_text(json.dumps(props, ensure_ascii=False))
-
-        output_file = OUT_DIR / f"{render_id}-slide-{i+1}-{name}.png"
-        run_remotion("still", "CarouselSlide", str(output_file), str(props_file))
+    return slides
+
+
+def plan_carousel_slides(render_id, slides, output):
+    """Rozpisz slajdy na pliki wyjściowe dla każdego rozmiaru"""
+    items = []
+    for size in output["sizes"]:
+        width, height = CAROUSEL_SIZES[size]
+        prefix = f"{size}/" if len(output["sizes"]) > 1 else ""
+
+        for i, (name, props) in enumerate(slides):
+            stem = f"{render_id}-{size}-slide-{i+1}-{name}"
+            output_file = OUT_DIR / f"{stem}.{output['ext']}"
+            items.append({
+                "props": props,
+                "width": width,
+                "height": height,
+                # Przy kodowaniu przez Pillow Remotion renderuje bezstratny PNG
+                "render_file": OUT_DIR / f"{stem}-raw.png" if output["encode"] else output_file,
+                "output_file": output_file,
+                "arcname": f"{prefix}karuzela-slide-{i+1}.{output['ext']}",
+                "job": None,
+            })
+    return items
 
-        props_file.unlink(missing_ok=True)
-        output_files.append(output_file)
 
-    # Create ZIP with all slides
+def zip_carousel(render_id, items, output, slide_count):
+    """Spakuj slajdy do ZIP (czeka na kodowanie w ENCODE_POOL)"""
+    # Already compressed images — store, don't deflate
     zip_path = OUT_DIR / f"{render_id}-karuzela.zip"
-    with zipfile.ZipFile(str(zip_path), "w") as zf:
-        for i, f in enumerate(output_files):
-            zf.write(str(f), f"karuzela-slide-{i+1}.png")
+    with zipfile.ZipFile(str(zip_path), "w", compression=zipfile.ZIP_STORED) as zf:
+        for item in items:
+            if item["job"] is not None:
+                item["job"].result()
+            zf.write(str(item["output_file"]), item["arcname"])
 
-    # Cleanup individual PNGs
-    for f in output_files:
-        f.unlink(missing_ok=True)
+    # Cleanup individual slides
+    for item in items:
+        item["output_file"].unlink(missing_ok=True)
 
-    return jsonify({
+    return {
         "success": True,
         "type": "carousel",
         "download_url": f"/download/{render_id}-karuzela.zip",
         "filename": f"karuzela-{render_id}.zip",
-        "slide_count": len(slides),
-    })
+        "slide_count": slide_count,
+        "format": output["format"],
+        "sizes": output["sizes"],
+    }
+
+
+def discard_carousel(render_id, items):
+    """Usuń pliki nieudanej karuzeli (czeka na rozpoczęte kodowanie)"""
+    for item in items:
+        if item["job"] is not None and not item["job"].cancel():
+            try:
+                item["job"].result()
+            except Exception:
+                pass
+        item["render_file"].unlink(missing_ok=True)
+        item["output_file"].unlink(missing_ok=True)
+    (OUT_DIR / f"{render_id}-karuzela.zip").unlink(missing_ok=True)
+
+
+def get_carousel_output(data):
+    """Wyciągnij opcje wyjściowe karuzeli (format, jakość, optymalizacja, rozmiary)"""
+    fmt = str(data.get("carouselFormat", "png")).lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in CAROUSEL_FORMATS:
+        raise ValueError(f"Nieznany format karuzeli: {fmt}")
+
+    quality = data.get("carouselQuality") or 85
+    try:
+        if isinstance(quality, bool):
+            raise TypeError(quality)
+        quality = min(max(int(quality), 1), 100)
+    except (ValueError, TypeError):
+        raise ValueError("Jakość karuzeli musi być liczbą 1-100")
+
+    sizes = data.get("carouselSizes") or ["1080x1080"]
+    if isinstance(sizes, str):
+        sizes = [sizes]
+    if not isinstance(sizes, list):
+        raise ValueError("carouselSizes musi być listą rozmiarów")
+    for size in sizes:
+        if not isinstance(size, str) or size not in CAROUSEL_SIZES:
+            raise ValueError(f"Nieznany rozmiar karuzeli: {size}")
+
+    optimize = data.get("carouselOptimize", False)
+    if isinstance(optimize, str):
+        optimize = optimize.strip().lower() in ("true", "1")
+    elif not isinstance(optimize, bool):
+        raise ValueError("carouselOptimize musi być true/false")
+
+    # Bez Pillow format ustawia sam Remotion (bez optymalizacji)
+    remotion_args = []
+    if fmt != "png":
+        remotion_args = ["--image-format", fmt]
+        if fmt == "jpeg":
+            remotion_args += ["--jpeg-quality", str(quality)]
+
+    return {
+        "format": fmt,
+        "ext": CAROUSEL_FORMATS[fmt],
+        "quality": quality,
+        "optimize": optimize,
+        "sizes": list(dict.fromkeys(sizes)),
+        "encode": HAS_PIL and (fmt != "png" or optimize),
+        "remotion_args": remotion_args,
+    }
+
+
+def encode_slide(raw_file, output_file, output):
+    """Zakoduj slajd PNG do docelowego formatu (wywoływane w ENCODE_POOL)"""
+    try:
+        with Image.open(raw_file) as im:
+            if output["format"] == "png":
+                im.save(output_file, "PNG", optimize=True)
+            elif output["format"] == "jpeg":
+                im.convert("RGB").save(
+                    output_file, "JPEG",
+                    quality=output["quality"],
+                    optimize=output["optimize"],
+                    progressive=output["optimize"],
+                )
+            else:
+                im.save(
+                    output_file, "WEBP",
+                    quality=output["quality"],
+                    method=6 if output["optimize"] else 4,
+                )
+    finally:
+        raw_file.unlink(missing_ok=True)
+    return output_file
 
 
 def render_sold(data, render_id):
     """Renderuj wideo 'Sprzedane!'"""
-    photos = data.get("photos", [])
-    if not photos:
+    if not data.get("photos"):
         return jsonify({"error": "Dodaj przynajmniej 1 zdjęcie"}), 400
 
+    props = build_sold_props(data)
+    props_file = OUT_DIR / f"{render_id}-props.json"
+    props_file.write_text(json.dumps(props, ensure_ascii=False))
+
+    output_file = OUT_DIR / f"{render_id}-sprzedane.mp4"
+    try:
+        run_remotion("render", "SoldVideo", str(output_file), str(props_file), render_id=render_id)
+    finally:
+        props_file.unlink(missing_ok=True)
+
+    return jsonify(video_result(render_id, "sprzedane"))
+
+
+def build_sold_props(data):
+    """Props dla SoldVideo"""
+    photos = data.get("photos", [])
     brand = get_brand(data)
     props = {
         "title": data.get("title", ""),
@@ -320,20 +700,7 @@ def render_sold(data, render_id):
     if effects:
         props["effects"] = effects
 
-    props_file = OUT_DIR / f"{render_id}-props.json"
-    props_file.write_text(json.dumps(props, ensure_ascii=False))
-
-    output_file = OUT_DIR / f"{render_id}-sprzedane.mp4"
-    run_remotion("render", "SoldVideo", str(output_file), str(props_file))
-
-    props_file.unlink(missing_ok=True)
-
-    return jsonify({
-        "success": True,
-        "type": "video",
-        "download_url": f"/download/{render_id}-sprzedane.mp4",
-        "filename": f"sprzedane-{render_id}.mp4",
-    })
+    return props
 
 
 def render_plot(data, render_id):
@@ -361,9 +728,10 @@ def render_plot(data, render_id):
     props_file.write_text(json.dumps(props, ensure_ascii=False))
 
     output_file = OUT_DIR / f"{render_id}-dzialka.mp4"
-    run_remotion("render", "PlotBuild", str(output_file), str(props_file))
-
-    props_file.unlink(missing_ok=True)
+    try:
+        run_remotion("render", "PlotBuild", str(output_file), str(props_file), render_id=render_id)
+    finally:
+        props_file.unlink(missing_ok=True)
 
     return jsonify({
         "success": True,
@@ -373,7 +741,101 @@ def render_plot(data, render_id):
     })
 
 
-def run_remotion(mode, composition, output, props_file):
+def render_pack(data, render_id):
+    """Renderuj pakiet oferty — kilka szablonów w jednej sesji Remotion"""
+    templates = data.get("templates") or list(PACK_TEMPLATES)
+    if isinstance(templates, str):
+        templates = [templates]
+    if not isinstance(templates, list):
+        return jsonify({"error": "templates musi być listą szablonów"}), 400
+    unknown = [str(t) for t in templates if t not in PACK_TEMPLATES]
+    if unknown:
+        return jsonify({"error": f"Szablon niedostępny w pakiecie: {', '.join(unknown)}"}), 400
+    if not data.get("photos"):
+        return jsonify({"error": "Dodaj przynajmniej 1 zdjęcie"}), 400
+
+    jobs = []
+    if "reel" in templates:
+        jobs.append({
+            "mode": "render",
+            "composition": "RealEstateReel",
+            "output": str(OUT_DIR / f"{render_id}-rolka.mp4"),
+            "props": build_reel_props(data),
+        })
+
+    if "carousel" in templates:
+        try:
+            output = get_carousel_output(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        slides = build_carousel_slides(data)
+        items = plan_carousel_slides(render_id, slides, output)
+        for item in items:
+            job = {
+                "mode": "still",
+                "composition": "CarouselSlide",
+                "output": str(item["render_file"]),
+                "props": item["props"],
+                "width": item["width"],
+                "height": item["height"],
+            }
+            if not output["encode"]:
+                job["imageFormat"] = output["format"]
+                job["jpegQuality"] = output["quality"]
+            jobs.append(job)
+
+    if "sold" in templates:
+        jobs.append({
+            "mode": "render",
+            "composition": "SoldVideo",
+            "output": str(OUT_DIR / f"{render_id}-sprzedane.mp4"),
+            "props": build_sold_props(data),
+        })
+
+    manifest_file = OUT_DIR / f"{render_id}-pack.json"
+    manifest_file.write_text(json.dumps({"jobs": jobs}, ensure_ascii=False))
+
+    # Slajd gotowy w render-pack.js -> od razu kodowanie w ENCODE_POOL,
+    # podczas gdy kolejne kompozycje jeszcze się renderują
+    pending = {}
+    if "carousel" in templates and output["encode"]:
+        pending = {str(item["render_file"]): item for item in items}
+
+    def on_line(line):
+        done = PACK_DONE_RE.match(line)
+        item = pending.pop(done.group(1), None) if done else None
+        if item is not None:
+            item["job"] = ENCODE_POOL.submit(encode_slide, item["render_file"], item["output_file"], output)
+
+    outputs = {}
+    try:
+        try:
+            run_command(["node", "render-pack.js", str(manifest_file)], render_id=render_id,
+                        timeout=600 * len(templates), on_line=on_line)
+        finally:
+            manifest_file.unlink(missing_ok=True)
+
+        if "carousel" in templates:
+            outputs["carousel"] = zip_carousel(render_id, items, output, len(slides))
+    except BaseException:
+        if "carousel" in templates:
+            discard_carousel(render_id, items)
+        raise
+
+    if "reel" in templates:
+        outputs["reel"] = video_result(render_id, "rolka")
+    if "sold" in templates:
+        outputs["sold"] = video_result(render_id, "sprzedane")
+
+    return jsonify({
+        "success": True,
+        "type": "pack",
+        "outputs": outputs,
+    })
+
+
+def run_remotion(mode, composition, output, props_file, extra_args=None, render_id=None):
     """Wywołaj Remotion CLI"""
     cmd = [
         "npx", "remotion", mode,
@@ -381,6 +843,8 @@ def run_remotion(mode, composition, output, props_file):
         output,
         "--props", props_file,
     ]
+    if extra_args:
+        cmd.extend(extra_args)
 
     if mode == "still":
         cmd.extend(["--frame", "0"])
@@ -388,20 +852,255 @@ def run_remotion(mode, composition, output, props_file):
         # Optymalizacja dla slabych serwerow (Render free tier)
         cmd.extend(["--concurrency", "1", "--gl", "angle"])
 
-    result = subprocess.run(
-        cmd,
-        cwd=str(BASE_DIR),
-        capture_output=True,
-        timeout=600,  # 10 min max
-    )
+    run_command(cmd, render_id=render_id)
+
+
+def run_command(cmd, render_id=None, timeout=600, on_line=None):
+    """Uruchom proces renderujący w katalogu projektu (domyślnie 10 min max).
+
+    Wyjście jest czytane na bieżąco i zamieniane na zdarzenia postępu
+    (oraz przekazywane do on_line, jeśli podano);
+    proces dostaje własną grupę, żeby anulowanie objęło całe drzewo (npx → node → chrome).
+    """
+    with RENDER_JOBS_LOCK:
+        job = RENDER_JOBS.get(render_id) if render_id else None
 
-    if result.returncode != 0:
+    # Czekaj na wolny slot, ale reaguj na anulowanie w kolejce
+    queued = False
+    while not RENDER_SLOTS.acquire(timeout=1):
+        if job and job["cancelled"]:
+            raise RenderCancelled()
+        if job and not queued:
+            push_render_event(render_id, {"type": "queued"})
+            queued = True
+
+    try:
+        if job and job["cancelled"]:
+            raise RenderCancelled()
+
+        # fork/exec poza blokadą — strumienie postępu nie czekają na start procesu
+        proc = subprocess.Popen(
+            cmd,
+            cwd=str(BASE_DIR),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        cancelled = False
+        if job:
+            with RENDER_JOBS_LOCK:
+                job["proc"] = proc
+                job["step"] += 1
+                step = job["step"]
+                cancelled = job["cancelled"]
+        if cancelled:
+            # Anulowanie przyszło w trakcie startu, zanim proc był widoczny
+            kill_process_tree(proc)
+
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            kill_process_tree(proc)
+
+        timer = threading.Timer(timeout, on_timeout)
+        timer.daemon = True
+        timer.start()
+
+        tail = deque(maxlen=200)
+        rate = {}  # punkt odniesienia tempa dla ETA (bieżący etap / kompozycja)
+        try:
+            for line in iter_output_lines(proc.stdout):
+                tail.append(line)
+                if on_line:
+                    on_line(line)
+                if not job:
+                    continue
+                if PACK_DONE_RE.match(line):
+                    # render-pack.js skończył kompozycję — kolejna to nowy krok
+                    with RENDER_JOBS_LOCK:
+                        job["step"] += 1
+                        step = job["step"]
+                    rate.clear()
+                    continue
+                progress = parse_progress(line)
+                if progress:
+                    estimate_eta(progress, rate, time.monotonic())
+                    push_render_event(render_id, {"type": "progress", "step": step, **progress})
+        except BaseException:
+            kill_process_tree(proc)
+            raise
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+            reap_process(proc, job)
+    finally:
+        RENDER_SLOTS.release()
+
+    output = "\n".join(tail).encode("utf-8")
+    if job and job["cancelled"]:
+        raise RenderCancelled()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, output=output)
+    if proc.returncode != 0:
         raise subprocess.CalledProcessError(
-            result.returncode, cmd,
-            output=result.stdout, stderr=result.stderr
+            proc.returncode, cmd,
+            output=output, stderr=output
         )
 
 
+def reap_process(proc, job):
+    """Zbierz zakończony proces i wyczyść job["proc"] atomowo względem anulowania.
+
+    poll() ustawia proc.returncode ("zebrany") pod RENDER_JOBS_LOCK, a kill_process_tree
+    sprawdza go pod tą samą blokadą — sygnał nigdy nie trafi w pid użyty ponownie.
+    """
+    while True:
+        with RENDER_JOBS_LOCK:
+            if proc.poll() is not None:
+                if job and job["proc"] is proc:
+                    job["proc"] = None
+                return
+        time.sleep(0.05)
+
+
+def kill_process_tree(proc):
+    """Zakończ drzewo procesów renderu: SIGTERM, po RENDER_KILL_GRACE s SIGKILL.
+
+    Chrome startowany przez Remotion jest "detached" (własna grupa procesów),
+    więc poza grupą npx sygnał dostają też wszyscy potomkowie zebrani z ps.
+    """
+    descendants = process_descendants(proc.pid)  # ps poza blokadą
+
+    def signal_tree(sig, pids):
+        with RENDER_JOBS_LOCK:
+            if proc.returncode is None:
+                try:
+                    os.killpg(proc.pid, sig)
+                except (ProcessLookupError, PermissionError):
+                    pass
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    def escalate():
+        # Tylko procesy, które nadal żyją pod tym samym pid i nazwą
+        table = process_table()
+        survivors = [pid for pid, comm in descendants.items() if pid in table and table[pid][1] == comm]
+        signal_tree(signal.SIGKILL, survivors)
+
+    signal_tree(signal.SIGTERM, list(descendants))
+    timer = threading.Timer(RENDER_KILL_GRACE, escalate)
+    timer.daemon = True
+    timer.start()
+
+
+def process_table():
+    """Tabela procesów {pid: (ppid, nazwa)} z ps (pusta, gdy ps niedostępny)"""
+    try:
+        out = subprocess.run(
+            ["ps", "-A", "-o", "pid=,ppid=,comm="],
+            capture_output=True, text=True, timeout=5,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+
+    table = {}
+    for row in out.splitlines():
+        parts = row.split(None, 2)
+        if len(parts) >= 2 and parts[0].isdigit() and parts[1].isdigit():
+            table[int(parts[0])] = (int(parts[1]), parts[2] if len(parts) > 2 else "")
+    return table
+
+
+def process_descendants(root_pid):
+    """Wszyscy potomkowie procesu {pid: nazwa}, także w innych grupach procesów"""
+    table = process_table()
+    children = {}
+    for pid, (ppid, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+
+    found = {}
+    stack = [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            if child not in found:
+                found[child] = table[child][1]
+                stack.append(child)
+    return found
+
+
+def iter_output_lines(stream):
+    """Czytaj wyjście procesu przyrostowo; paski postępu nadpisują linię przez \\r"""
+    buffer = b""
+    while True:
+        chunk = stream.read1(4096)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = re.split(rb"[\r\n]", buffer)
+        for line in lines:
+            if line.strip():
+                yield line.decode("utf-8", errors="replace").strip()
+    if buffer.strip():
+        yield buffer.decode("utf-8", errors="replace").strip()
+
+
+def parse_progress(line):
+    """Zamień linię wyjścia Remotion na zdarzenie postępu (lub None)"""
+    match = None
+    for stage, pattern in PROGRESS_STAGES:
+        match = pattern.search(line)
+        if match:
+            break
+    if match is None:
+        return None
+
+    # Liczby należą do słowa etapu: w "Rendered 240/240, encoded 30/240"
+    # etap encoding to 30/240, nie pierwsza para w linii
+    start = match.end()
+    next_keyword = PROGRESS_KEYWORD_RE.search(line, start)
+    segment = line[start:next_keyword.start() if next_keyword else len(line)]
+
+    progress = {"stage": stage}
+    frames = PROGRESS_FRAMES_RE.search(segment)
+    percent = PROGRESS_PERCENT_RE.search(segment)
+    if frames and int(frames.group(2)) > 0:
+        done, total = int(frames.group(1)), int(frames.group(2))
+        progress.update(frame=done, total=total, percent=round(100 * done / total, 1))
+    elif percent:
+        progress["percent"] = float(percent.group(1))
+    else:
+        return None
+
+    eta = PROGRESS_ETA_RE.search(line)
+    if eta:
+        units = {"h": 3600, "m": 60, "s": 1}
+        progress["eta"] = sum(int(n) * units[u] for n, u in re.findall(r"(\d+)\s*([hms])", eta.group(1)))
+
+    return progress
+
+
+def estimate_eta(progress, rate, now):
+    """Uzupełnij ETA z tempa od początku bieżącego etapu.
+
+    Punkt odniesienia zeruje się przy zmianie etapu i gdy licznik klatek spada
+    (nowa kompozycja), więc bundling i wcześniejsze kompozycje nie zawyżają szacunku.
+    """
+    last = rate.get("last", 0)
+    rate["last"] = progress["percent"]
+    if progress["stage"] != rate.get("stage") or progress["percent"] < last:
+        rate.update(stage=progress["stage"], percent=progress["percent"], at=now)
+        return
+    if "eta" in progress or progress["stage"] == "bundling" or progress["percent"] >= 100:
+        return
+    done = progress["percent"] - rate["percent"]
+    if done > 0:
+        progress["eta"] = round((now - rate["at"]) * (100 - progress["percent"]) / done)
+
+
 @app.route("/download/<filename>")
 def download_file(filename):
     """Pobierz wyrenderowany plik"""